@@ -5,304 +5,888 @@ Monitors XGT token transactions and logs wash trading bots
 """
 
 import os
-import json
-from datetime import datetime
+import sys
+import time
+import logging
+import random
+import asyncio
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import attrgetter
+import aiohttp
+import numpy as np
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timezone
 from web3 import Web3
-from collections import defaultdict
+try:
+    from numba import njit
+except ImportError:  # Numba is optional - patterns fall back to vectorized NumPy
+    njit = None
 
-# Configuration - Multiple RPC endpoints for fallback
-BSC_RPCS = [
+log = logging.getLogger('hyperion_guard')
+
+# Configuration - Multiple RPC endpoints for fallback (override with BSC_RPCS="url1,url2")
+BSC_RPCS = [rpc.strip() for rpc in os.environ.get('BSC_RPCS', '').split(',') if rpc.strip()] or [
     'https://bsc.publicnode.com',
     'https://rpc.ankr.com/bsc',
     'https://1rpc.io/bnb',
     'https://bsc-dataseed1.defibit.io/',
     'https://bsc-dataseed.binance.org/',
 ]
+# Comma-separated to follow a token migration: logs from every listed contract
+# are fetched with one address-array filter (checksummed once, not per request)
 XGT_CONTRACT = os.environ.get('XGT_CONTRACT', '0x654E38A4516F5476D723D770382A5EaF8Bae0e0D')
+XGT_ADDRESSES = [Web3.to_checksum_address(a.strip()) for a in XGT_CONTRACT.split(',') if a.strip()]
+if not XGT_ADDRESSES:
+    # An empty address list would make nodes return Transfer logs for every BSC token
+    raise Exception("❌ XGT_CONTRACT is empty - set at least one token contract address")
+
+# PancakeSwap LP pair. Pair-only mode is opt-in (PAIR_ONLY=1): only transfers
+# to/from the pair are fetched (the node filters on the indexed topics) and
+# the pair is not scored as a trader. Default = monitor ALL transfers
+LP_PAIR = os.environ.get('LP_PAIR', '')
+PAIR_ONLY = os.environ.get('PAIR_ONLY', '') == '1'
+if PAIR_ONLY and not LP_PAIR:
+    raise Exception("❌ PAIR_ONLY=1 needs LP_PAIR set to the PancakeSwap pair address")
+# Normalised through the checksum helper so a malformed pair fails here, not as
+# a topic filter every node rejects
+LP_ADDRESS = Web3.to_checksum_address(LP_PAIR.strip()).lower() if PAIR_ONLY else ''
+
+# Zero address as a 32-byte topic - mints/burns are skipped before decoding
+ZERO_TOPIC = '0x' + '00' * 32
 
 # Detection thresholds - AGGRESSIVE for faster detection
 MIN_TRADES_TO_FLAG = 4  # Reduced from 8 to catch bots faster
 MAX_AVG_HOLD_BLOCKS = 100
 WASH_TRADING_THRESHOLD = 0.75  # More sensitive (was 0.85)
 MAX_TRADES_PER_HOUR = 15  # Lower threshold (was 20)
+CHECK_DELTA = 4  # Re-score a trader only after this many new trades
+PRUNE_BLOCKS = 28800  # Patterns only look at the last ~24h of trades (3s blocks)
+
+# Trade sides as stored in stats['sides'] (relative to the trader)
+BUY = 1    # received XGT
+SELL = -1  # sent XGT
+
+# Adaptive get_logs window - shrinks on RPC errors, grows on success
+INITIAL_SPAN = 200
+MIN_SPAN = 16
+MAX_SPAN = 2000
+SCAN_BUDGET = 60  # seconds of log fetching per run; the rest is caught up next run
+MAX_CONCURRENT_BATCHES = 8  # Parallel batch POSTs - stays under public dataseed limits
+RPC_BATCH_SIZE = 20  # eth_getLogs requests packed into one JSON-RPC batch
+
+# RPC circuit breaker - an endpoint failing 3x within 30s is skipped for 30s
+RPC_TIMEOUT = 10  # seconds per call
+BREAKER_FAILURES = 3
+BREAKER_WINDOW = 30
+BREAKER_COOLDOWN = 30
+RPC_RETRY_ROUNDS = 3
+RPC_RETRY_DELAY = 1.0  # base delay between rounds, doubled each round with jitter
+HEDGE_DELAY = 0.5  # async calls race the next endpoint if no answer by then
+HEDGE_MAX_IN_FLIGHT = 2  # primary + one duplicate, so slow batches don't fan out to every node
+PROBE_TIMEOUT = 2  # startup head probe, sent to every endpoint at once
+
+# Endpoint ranking - smoothed latency plus a penalty per recent error (persisted)
+LATENCY_SMOOTHING = 0.05
+ERROR_PENALTY_MS = 5000
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Transfer(address,address,uint256) topic0 - lets us pull raw logs without ABI decoding
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text='Transfer(address,address,uint256)'))
+LP_TOPIC = '0x' + '00' * 12 + LP_ADDRESS[2:]
+
+# Topic lists are built once and shared by every window's filters
+if LP_ADDRESS:
+    FILTER_TOPICS = [[TRANSFER_TOPIC, LP_TOPIC], [TRANSFER_TOPIC, None, LP_TOPIC]]
+else:
+    FILTER_TOPICS = [[TRANSFER_TOPIC]]
 
-# Minimal ABI for Transfer events
-CONTRACT_ABI = [{
-    "anonymous": False,
-    "inputs": [
-        {"indexed": True, "type": "address", "name": "from"},
-        {"indexed": True, "type": "address", "name": "to"},
-        {"indexed": False, "type": "uint256", "name": "value"}
-    ],
-    "name": "Transfer",
-    "type": "event"
-}]
+def transfer_filters(from_block, to_block):
+    """eth_getLogs filters for XGT Transfer events in [from_block, to_block]
+    
+    One broad filter in monitor mode; in pair-only mode, one filter for
+    transfers out of the pair (buys) and one for transfers into it (sells).
+    """
+    base = {'address': XGT_ADDRESSES, 'fromBlock': hex(from_block), 'toBlock': hex(to_block)}
+    return [dict(base, topics=topics) for topics in FILTER_TOPICS]
+
+def merge_logs(parts):
+    """Merge the per-filter log lists back into chain order"""
+    if len(parts) == 1:
+        return parts[0]
+    return sorted(
+        (l for part in parts for l in part),
+        key=lambda l: (int(l['blockNumber'], 16), int(l['logIndex'], 16))
+    )
+
+def rpc_request(method, params, request_id=1):
+    """JSON-RPC 2.0 request object"""
+    return {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}
+
+def rpc_result(response):
+    """Result of one JSON-RPC response; an error answered by the node raises ValueError"""
+    if 'error' in response:
+        raise ValueError(response['error'])
+    return response['result']
+
+def batch_results(responses, count):
+    """Results of a JSON-RPC batch reply, indexed by request id 0..count-1
+    
+    Replies may come back in any order. Ids that are missing, failed or
+    malformed get None.
+    """
+    results = [None] * count
+    for response in responses:
+        if not isinstance(response, dict) or 'result' not in response:
+            continue
+        request_id = response.get('id')
+        if type(request_id) is int and 0 <= request_id < count:
+            results[request_id] = response['result']
+    return results
+
+def new_stats(first_seen=0):
+    """Empty per-trader stats: parallel int64 block / int8 side columns, one entry per trade
+    
+    The columns only hold the last PRUNE_BLOCKS of trades; first_seen and
+    total_trades cover the trader's whole history.
+    """
+    return {
+        'blocks': array('q'), 'sides': array('b'), 'first_seen': first_seen,
+        'total_trades': 0, '_last_checked_len': 0
+    }
+
+def column_view(column):
+    """Zero-copy NumPy view of a block/side column (orjson encodes it natively)"""
+    return np.frombuffer(column, dtype=np.int64 if column.typecode == 'q' else np.int8)
+
+def prune_stats(stats, cutoff):
+    """Drop trades older than cutoff (columns are block-ordered)"""
+    blocks = stats['blocks']
+    if blocks and blocks[0] < cutoff:
+        i = bisect_left(blocks, cutoff)
+        del blocks[:i]
+        del stats['sides'][:i]
+
+def stats_from_legacy(stats):
+    """Convert stats saved with a dict per trade into block/side columns"""
+    converted = new_stats(stats['first_seen'])
+    converted['blocks'] = array('q', [t['block'] for t in stats['trades']])
+    converted['sides'] = array('b', [SELL if t['type'] == 'send' else BUY for t in stats['trades']])
+    converted['total_trades'] = len(stats['trades'])
+    return converted
+
+def detect_patterns_numpy(blocks, sides, first_seen, total_trades):
+    """Pattern metrics for one trader's block/side columns
+    
+    Returns (buy_count, sell_count, avg_hold, trades_per_hour, same_block);
+    avg_hold is -1 when no sell follows a buy, trades_per_hour 0 when the
+    trader has only been seen in one block. The trade rate uses the
+    lifetime total_trades over [first_seen, last block].
+    """
+    is_buy = sides == BUY
+    buy_count = int(is_buy.sum())
+    sell_count = len(sides) - buy_count
+    
+    # Latest buy strictly before each sell
+    buy_blocks = blocks[is_buy]
+    sell_blocks = blocks[~is_buy]
+    latest_buy = np.searchsorted(buy_blocks, sell_blocks) - 1
+    paired = latest_buy >= 0
+    avg_hold = -1.0
+    if paired.any():
+        avg_hold = float((sell_blocks[paired] - buy_blocks[latest_buy[paired]]).mean())
+    
+    block_range = int(blocks[-1]) - first_seen
+    trades_per_hour = (total_trades / block_range) * 1200 if block_range > 0 else 0.0
+    
+    # Adjacent trades in the same block on opposite sides: with (block << 1) | is_sell
+    # packed into one int64, that is exactly an XOR of 1 between neighbours
+    packed = (blocks << 1) | ~is_buy
+    same_block = bool(np.any((packed[1:] ^ packed[:-1]) == 1))
+    
+    return buy_count, sell_count, avg_hold, trades_per_hour, same_block
+
+if njit is not None:
+    @njit(cache=True)
+    def detect_patterns(blocks, sides, first_seen, total_trades):
+        """Numba kernel for detect_patterns_numpy - all four metrics in one pass"""
+        buy_count = 0
+        hold_blocks = 0
+        pairs = 0
+        last_buy = -1   # latest buy block so far
+        prev_buy = -1   # latest buy block before last_buy
+        same_block = False
+        for i in range(len(blocks)):
+            block = blocks[i]
+            if i > 0 and blocks[i - 1] == block and sides[i - 1] != sides[i]:
+                same_block = True
+            if sides[i] == BUY:
+                buy_count += 1
+                if block > last_buy:
+                    prev_buy = last_buy
+                    last_buy = block
+            else:
+                latest = prev_buy if last_buy == block else last_buy
+                if latest >= 0:
+                    hold_blocks += block - latest
+                    pairs += 1
+        
+        avg_hold = hold_blocks / pairs if pairs > 0 else -1.0
+        block_range = blocks[len(blocks) - 1] - first_seen
+        trades_per_hour = (total_trades / block_range) * 1200.0 if block_range > 0 else 0.0
+        return buy_count, len(blocks) - buy_count, avg_hold, trades_per_hour, same_block
+else:
+    detect_patterns = detect_patterns_numpy
+
+class BufferedLogHandler(logging.StreamHandler):
+    """StreamHandler without the per-record flush - run() flushes stdout once at the end"""
+    
+    def flush(self):
+        pass
+
+class RpcEndpoint:
+    """A BSC RPC endpoint spoken to with raw JSON-RPC, with circuit breaker
+    state (CLOSED -> OPEN -> HALF_OPEN)"""
+    
+    def __init__(self, url):
+        self.url = url
+        # Own keep-alive session per endpoint so calls reuse one TLS connection
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=0))
+        self.failures = 0
+        self.last_failure_ts = 0
+        self.open_until = 0
+        self.probing = False
+        self.rolling_ms = 500.0
+        self.errors = 0
+    
+    def post(self, payload, timeout=RPC_TIMEOUT):
+        """POST a JSON-RPC request (or batch array) and return the decoded body"""
+        response = self.session.post(
+            self.url, data=orjson.dumps(payload), headers=JSON_HEADERS, timeout=timeout
+        )
+        response.raise_for_status()
+        return self.decode(response.content)
+    
+    def decode(self, body):
+        """Decode a response body; anything that isn't JSON counts as an endpoint failure"""
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # JSONDecodeError is a ValueError, which callers read as "node answered
+            # with an error" - an HTML error or rate-limit page is not that
+            raise ConnectionError(f"non-JSON response from {self.url}") from None
+    
+    def request(self, method, *params):
+        return rpc_result(self.post(rpc_request(method, list(params))))
+    
+    async def post_async(self, http, payload):
+        """post() over the scan's shared aiohttp session"""
+        async with http.post(self.url, data=orjson.dumps(payload), headers=JSON_HEADERS) as response:
+            response.raise_for_status()
+            return self.decode(await response.read())
+    
+    @property
+    def score(self):
+        """Lower is better - calls try endpoints in score order"""
+        return self.rolling_ms + ERROR_PENALTY_MS * self.errors
+    
+    def record_latency(self, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.rolling_ms += LATENCY_SMOOTHING * (elapsed_ms - self.rolling_ms)
+    
+    @property
+    def state(self):
+        if not self.open_until:
+            return 'CLOSED'
+        if time.monotonic() < self.open_until:
+            return 'OPEN'
+        return 'HALF_OPEN'
+    
+    def acquire(self):
+        """True if a call may go to this endpoint (HALF_OPEN allows a single probe)"""
+        state = self.state
+        if state == 'CLOSED':
+            return True
+        if state == 'HALF_OPEN' and not self.probing:
+            self.probing = True
+            return True
+        return False
+    
+    def release(self):
+        """Give back an acquire() whose call was abandoned (cancelled hedge)"""
+        self.probing = False
+    
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0
+        self.probing = False
+    
+    def record_failure(self):
+        now = time.monotonic()
+        if now - self.last_failure_ts > BREAKER_WINDOW:
+            self.failures = 0
+        self.failures += 1
+        self.errors += 1
+        self.last_failure_ts = now
+        # A failed probe re-opens immediately
+        if self.failures >= BREAKER_FAILURES or self.probing:
+            self.open_until = now + BREAKER_COOLDOWN
+        self.probing = False
 
 class HyperionGuard:
     def __init__(self):
-        print("=" * 70)
-        print("🛡️  HYPERION GUARD - AUTONOMOUS BOT DETECTION SYSTEM")
-        print("=" * 70)
-        print("MODE: MONITOR & LOG (No Auto-Blacklist)")
-        print("=" * 70)
-        
-        # Try multiple RPCs until one works
-        self.w3 = None
-        for rpc in BSC_RPCS:
-            try:
-                w3_temp = Web3(Web3.HTTPProvider(rpc))
-                if w3_temp.is_connected():
-                    self.w3 = w3_temp
-                    print(f"✅ Connected via: {rpc}")
-                    break
-            except:
-                continue
+        log.info("=" * 70)
+        log.info("🛡️  HYPERION GUARD - AUTONOMOUS BOT DETECTION SYSTEM")
+        log.info("=" * 70)
+        log.info("MODE: MONITOR & LOG (No Auto-Blacklist)")
+        log.info("=" * 70)
         
-        if not self.w3 or not self.w3.is_connected():
-            raise Exception("❌ Failed to connect to any BSC RPC")
+        # All RPC calls go through the breaker-guarded endpoint pool
+        self.endpoints = [RpcEndpoint(rpc) for rpc in BSC_RPCS]
         
-        print(f"✅ Connected to BSC (Block: {self.w3.eth.block_number})")
+        # State first, so startup probes refine last run's endpoint ranking
+        self.load_state()
+        self._dirty = False  # set once a scan has blocks to process; run() skips the write otherwise
+        self.pending_checks = set()  # traders to score at the end of the current window
+        self.detection_log = open('blacklisted.log', 'a', buffering=64 * 1024)
         
-        self.contract = self.w3.eth.contract(
-            address=Web3.to_checksum_address(XGT_CONTRACT),
-            abi=CONTRACT_ABI
-        )
+        # Head is fetched once here and reused by the scan
+        try:
+            self.head_block = self.probe_endpoints()
+        except ConnectionError:
+            try:
+                # Nobody answered the quick probe - retry with backoff and the full timeout
+                self.head_block = self.rpc_call(lambda ep: int(ep.request('eth_blockNumber'), 16))
+            except ConnectionError:
+                raise Exception("❌ Failed to connect to any BSC RPC")
+        if self.last_block is None:
+            self.last_block = self.head_block - 5
         
-        print(f"✅ XGT Contract: {XGT_CONTRACT}")
-        print(f"✅ Monitoring: ALL XGT transfers (not limited to specific pairs)")
+        log.info(f"✅ Connected via: {self.last_endpoint.url}")
+        log.info(f"✅ Connected to BSC (Block: {self.head_block})")
         
-        self.load_state()
-        print(f"✅ Loaded state (Last block: {self.last_block})")
-        print("=" * 70 + "\n")
+        log.info(f"✅ XGT Contract: {XGT_CONTRACT}")
+        if LP_ADDRESS:
+            log.info(f"✅ Monitoring: XGT transfers to/from LP pair {LP_ADDRESS}")
+        else:
+            log.info(f"✅ Monitoring: ALL XGT transfers (not limited to specific pairs)")
+        
+        log.info(f"✅ Loaded state (Last block: {self.last_block})")
+        
+        if njit is not None:
+            # Compile now so JIT time isn't billed to the first real check
+            detect_patterns(np.zeros(1, dtype=np.int64), np.ones(1, dtype=np.int8), 0, 1)
+            log.info(f"✅ Pattern kernel: Numba JIT")
+        log.info("=" * 70 + "\n")
         
     def load_state(self):
         """Load tracking data from previous runs"""
         try:
-            with open('bot_state.json', 'r') as f:
-                data = json.load(f)
-                self.last_block = data.get('last_block', self.w3.eth.block_number - 5)
-                self.trader_stats = defaultdict(
-                    lambda: {'buys': [], 'sells': [], 'trades': [], 'first_seen': 0},
-                    {k: v for k, v in data.get('trader_stats', {}).items()}
-                )
-                self.detected_bots = set(data.get('detected_bots', []))
+            with open('bot_state.json', 'rb') as f:
+                data = orjson.loads(f.read())
+                self.last_block = data.get('last_block')
+                self.span = data.get('span', INITIAL_SPAN)
+                # Loaded dict is used as-is; only older states (checksummed keys,
+                # a dict per trade) are rebuilt
+                self.trader_stats = data.get('trader_stats', {})
+                if self.trader_stats and 'blocks' not in next(iter(self.trader_stats.values())):
+                    self.trader_stats = {
+                        address.lower(): stats_from_legacy(stats)
+                        for address, stats in self.trader_stats.items()
+                    }
+                else:
+                    for stats in self.trader_stats.values():
+                        stats['blocks'] = array('q', stats['blocks'])
+                        stats['sides'] = array('b', stats['sides'])
+                self.detected_bots = {a.lower() for a in data.get('detected_bots', [])}
+                rpc_stats = data.get('rpc_stats', {})
+                for endpoint in self.endpoints:
+                    if endpoint.url in rpc_stats:
+                        endpoint.rolling_ms = rpc_stats[endpoint.url]['rolling_ms']
+                        # Errors decay each run so a node that recovered climbs back
+                        endpoint.errors = rpc_stats[endpoint.url]['errors'] // 2
         except FileNotFoundError:
-            print("⚠️  No previous state found, starting fresh")
-            self.last_block = self.w3.eth.block_number - 5
-            self.trader_stats = defaultdict(lambda: {
-                'buys': [], 'sells': [], 'trades': [], 'first_seen': 0
-            })
+            log.info("⚠️  No previous state found, starting fresh")
+            self.last_block = None
+            self.span = INITIAL_SPAN
+            self.trader_stats = {}
             self.detected_bots = set()
     
     def save_state(self):
-        """Save tracking data for next run"""
-        with open('bot_state.json', 'w') as f:
-            json.dump({
+        """Save tracking data for next run (write to a temp file, then atomic rename)"""
+        # Traders that went quiet still carry old trades - trim them before writing,
+        # and drop the ones left empty (a returning trader starts fresh)
+        cutoff = self.last_block - PRUNE_BLOCKS
+        for address, stats in list(self.trader_stats.items()):
+            prune_stats(stats, cutoff)
+            if not stats['blocks'] and address not in self.detected_bots:
+                del self.trader_stats[address]
+        
+        with open('bot_state.json.tmp', 'wb') as f:
+            f.write(orjson.dumps({
                 'last_block': self.last_block,
-                'last_update': datetime.utcnow().isoformat(),
-                'trader_stats': {k: v for k, v in self.trader_stats.items()},
+                'span': self.span,
+                'last_update': datetime.now(timezone.utc).isoformat(),
+                'trader_stats': self.trader_stats,
                 'detected_bots': list(self.detected_bots),
+                'rpc_stats': {
+                    endpoint.url: {'rolling_ms': endpoint.rolling_ms, 'errors': endpoint.errors}
+                    for endpoint in self.endpoints
+                },
                 'total_scanned': len(self.trader_stats),
                 'total_detected': len(self.detected_bots)
-            }, f, indent=2)
+            }, default=column_view, option=orjson.OPT_SERIALIZE_NUMPY))
+        os.replace('bot_state.json.tmp', 'bot_state.json')
     
-    def scan_recent_blocks(self):
-        """Scan recent blocks for XGT transfers - CHUNKED to catch all activity"""
-        current_block = self.w3.eth.block_number
-        CHUNK_SIZE = 5  # Scan 5 blocks at a time to avoid RPC limits
-        MAX_CHUNKS = 20  # Max 20 chunks per run = 100 blocks total
+    def probe_endpoints(self):
+        """Ask every endpoint for the head block in parallel and return the first answer
+        
+        Startup waits for the fastest endpoint instead of timing out on dead
+        ones in turn; slower probes finish in the background and still feed
+        their endpoint's latency stats.
+        """
+        def probe(endpoint):
+            started = time.perf_counter()
+            try:
+                head = int(rpc_result(endpoint.post(rpc_request('eth_blockNumber', []), PROBE_TIMEOUT)), 16)
+            except Exception:
+                endpoint.record_failure()
+                raise
+            endpoint.record_latency(started)
+            endpoint.record_success()
+            return endpoint, head
+        
+        pool = ThreadPoolExecutor(max_workers=len(self.endpoints))
+        try:
+            for future in as_completed([pool.submit(probe, endpoint) for endpoint in self.endpoints]):
+                if future.exception() is None:
+                    self.last_endpoint, head = future.result()
+                    return head
+        finally:
+            pool.shutdown(wait=False)
+        raise ConnectionError("all BSC RPC endpoints failed")
+    
+    def rpc_call(self, call, rounds=RPC_RETRY_ROUNDS):
+        """Run call(endpoint) on the best-ranked available endpoint, failing over on errors"""
+        for attempt in range(rounds):
+            for endpoint in sorted(self.endpoints, key=attrgetter('score')):
+                if not endpoint.acquire():
+                    continue
+                started = time.perf_counter()
+                try:
+                    result = call(endpoint)
+                except ValueError:
+                    # Node answered with an error (e.g. range too large) - still healthy
+                    endpoint.record_latency(started)
+                    endpoint.record_success()
+                    continue
+                except Exception:
+                    endpoint.record_failure()
+                    continue
+                endpoint.record_latency(started)
+                endpoint.record_success()
+                self.last_endpoint = endpoint
+                return result
+            if attempt + 1 < rounds:
+                # Jittered exponential backoff so retries don't stampede the nodes
+                time.sleep(RPC_RETRY_DELAY * 2 ** attempt * random.uniform(0.7, 1.3))
+        raise ConnectionError("all BSC RPC endpoints failed")
+    
+    async def rpc_call_async(self, call, rounds=1):
+        """Async rpc_call: race call(endpoint) across endpoints, FallbackProvider-style
+        
+        The first endpoint gets a HEDGE_DELAY head start; if it stalls the next
+        one is raced against it (at most HEDGE_MAX_IN_FLIGHT calls at once), and
+        a failed call is replaced by the next endpoint. The first valid result
+        wins and the calls still in flight are cancelled.
+        """
+        for attempt in range(rounds):
+            candidates = iter(sorted(self.endpoints, key=attrgetter('score')))
+            in_flight = {}
+            winner_started = None
+            
+            def hedge():
+                for endpoint in candidates:
+                    if endpoint.acquire():
+                        task = asyncio.create_task(asyncio.wait_for(call(endpoint), RPC_TIMEOUT))
+                        in_flight[task] = (endpoint, time.perf_counter())
+                        return
+            
+            hedge()
+            try:
+                while in_flight:
+                    done, _ = await asyncio.wait(
+                        in_flight, timeout=HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not done:
+                        if len(in_flight) < HEDGE_MAX_IN_FLIGHT:
+                            hedge()  # stalled - race the next endpoint against it
+                        continue
+                    for task in done:
+                        endpoint, started = in_flight.pop(task)
+                        try:
+                            result = task.result()
+                        except ValueError:
+                            endpoint.record_latency(started)
+                            endpoint.record_success()
+                            hedge()
+                            continue
+                        except Exception:
+                            endpoint.record_failure()
+                            hedge()
+                            continue
+                        endpoint.record_latency(started)
+                        endpoint.record_success()
+                        winner_started = started
+                        return result
+            finally:
+                for task, (endpoint, started) in in_flight.items():
+                    task.cancel()
+                    endpoint.release()
+                    # A loser launched before the winner was at least this slow; one
+                    # launched after it was cut short, so its elapsed time means nothing
+                    if winner_started is not None and started < winner_started:
+                        endpoint.record_latency(started)
+            if attempt + 1 < rounds:
+                await asyncio.sleep(RPC_RETRY_DELAY * 2 ** attempt * random.uniform(0.7, 1.3))
+        raise ConnectionError("all BSC RPC endpoints failed")
+    
+    async def fetch_batch_async(self, http, semaphore, filters):
+        """Send eth_getLogs for each filter as one JSON-RPC batch
+        
+        Returns one entry per filter: its logs, or None if that element (or
+        the whole batch, on every RPC) failed.
+        """
+        payload = [rpc_request('eth_getLogs', [f], i) for i, f in enumerate(filters)]
+        
+        async def post_batch(endpoint):
+            responses = await endpoint.post_async(http, payload)
+            if not isinstance(responses, list):
+                raise ValueError(f"batch not supported: {responses}")
+            return responses
+        
+        async with semaphore:
+            try:
+                responses = await self.rpc_call_async(post_batch)
+            except ConnectionError:
+                return [None] * len(filters)
+        
+        # Elements without a usable id leave their window failed
+        return batch_results(responses, len(filters))
+    
+    async def fetch_range_async(self, http, semaphore, from_block, to_block, span, deadline):
+        """Fetch [from_block, to_block] as batched windows, re-splitting failed windows
         
+        Returns an ordered list of (start, end, logs); logs is None for windows
+        that still failed at MIN_SPAN, or that failed after the deadline passed
+        (they are retried next run).
+        """
+        windows = [(s, min(s + span - 1, to_block)) for s in range(from_block, to_block + 1, span)]
+        window_filters = [(w, f) for w, (s, e) in enumerate(windows) for f in transfer_filters(s, e)]
+        batches = [
+            window_filters[i:i + RPC_BATCH_SIZE] for i in range(0, len(window_filters), RPC_BATCH_SIZE)
+        ]
+        replies = await asyncio.gather(
+            *(self.fetch_batch_async(http, semaphore, [f for _, f in batch]) for batch in batches)
+        )
+        
+        # Regroup per window; a window fails if any of its filters failed
+        parts = [[] for _ in windows]
+        failed = set()
+        for batch, results in zip(batches, replies):
+            for (w, _), logs in zip(batch, results):
+                if logs is None:
+                    failed.add(w)
+                else:
+                    parts[w].append(logs)
+        
+        if failed:
+            self.windows_failed = True
+        
+        ordered = []
+        for w, (s, e) in enumerate(windows):
+            if w not in failed:
+                ordered.append([(s, e, merge_logs(parts[w]))])
+                continue
+            half = (e - s + 1) // 2
+            if half < MIN_SPAN or time.monotonic() >= deadline:
+                ordered.append([(s, e, None)])
+                continue
+            # Next run starts from a span that is known to work
+            self.span = max(MIN_SPAN, min(self.span, half))
+            ordered.append(self.fetch_range_async(http, semaphore, s, e, half, deadline))
+        
+        # Re-split windows are resubmitted concurrently too
+        pending = [item for item in ordered if not isinstance(item, list)]
+        resplit = iter(await asyncio.gather(*pending))
+        return [w for item in ordered for w in (item if isinstance(item, list) else next(resplit))]
+    
+    async def fetch_windows_async(self, from_block, to_block):
+        """Fetch all Transfer logs in [from_block, to_block] as concurrent JSON-RPC batches"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+        # One pooled aiohttp session for the whole scan (sessions are bound to the event loop)
+        async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit_per_host=MAX_CONCURRENT_BATCHES)
+        ) as http:
+            # Fetch in waves of as many windows as the batches can carry, so a
+            # long catch-up stops at the time budget instead of running unbounded
+            self.windows_failed = False  # set by fetch_range_async on any failed window
+            deadline = time.monotonic() + SCAN_BUDGET
+            windows = []
+            start = from_block
+            while start <= to_block and time.monotonic() < deadline:
+                end = min(start + self.span * RPC_BATCH_SIZE * MAX_CONCURRENT_BATCHES - 1, to_block)
+                wave = await self.fetch_range_async(http, semaphore, start, end, self.span, deadline)
+                windows.extend(wave)
+                if any(logs is None for _, _, logs in wave):
+                    break  # windows past the gap would be dropped anyway
+                start = end + 1
+            return windows
+    
+    def fetch_head_and_transfers(self, from_block, to_block):
+        """Refresh the chain head and fetch the first log window in one batched round-trip"""
+        payload = [rpc_request('eth_blockNumber', [], 0)] + [
+            rpc_request('eth_getLogs', [f], i + 1)
+            for i, f in enumerate(transfer_filters(from_block, to_block))
+        ]
+        
+        def batched(endpoint):
+            responses = endpoint.post(payload)
+            if not isinstance(responses, list):
+                raise ValueError(f"batch not supported: {responses}")
+            results = batch_results(responses, len(payload))
+            if results[0] is None:
+                raise ValueError(f"batch reply without a head: {responses}")
+            return results
+        
+        try:
+            head, *parts = self.rpc_call(batched, rounds=1)
+        except ConnectionError:
+            # No endpoint took the batch - fall back to a plain head query
+            return self.rpc_call(lambda ep: int(ep.request('eth_blockNumber'), 16)), None
+        # A short reply must not pass for an empty window - the async path refetches it
+        if any(logs is None for logs in parts):
+            return int(head, 16), None
+        return int(head, 16), merge_logs(parts)
+    
+    def scan_recent_blocks(self):
+        """Scan recent blocks for XGT transfers - ADAPTIVE window to catch all activity"""
         start_block = self.last_block + 1
-        blocks_behind = current_block - start_block
+        
+        # First window is bounded by the head seen at startup so it can ride
+        # in the same batch as the head refresh
+        prefetched = None
+        if start_block <= self.head_block:
+            first_end = min(start_block + self.span - 1, self.head_block)
+            current_block, prefetched = self.fetch_head_and_transfers(start_block, first_end)
+        else:
+            current_block = self.head_block
+        
+        blocks_behind = current_block - self.last_block
         
         if blocks_behind <= 0:
-            print(f"✅ Already up to date (block {current_block})")
+            log.info(f"✅ Already up to date (block {current_block})")
             return
         
-        print(f"📊 {blocks_behind} blocks to scan (chunking by {CHUNK_SIZE})")
+        log.info(f"📊 {blocks_behind} blocks to scan (window starts at {self.span})")
+        
+        # From here on last_block, span and endpoint stats change even when
+        # every transfer is skipped (detected bots, mints/burns)
+        self._dirty = True
+        
+        windows = []
+        rest_start = start_block
+        if prefetched is not None:
+            windows.append((start_block, first_end, prefetched))
+            rest_start = first_end + 1
+        
+        if rest_start <= current_block:
+            windows.extend(asyncio.run(self.fetch_windows_async(rest_start, current_block)))
+            # Grow only after a clean run - a failure at MIN_SPAN leaves the span as is
+            if not self.windows_failed:
+                self.span = min(MAX_SPAN, self.span * 2)
+            else:
+                log.info(f"⚠️  Some windows failed, span now {self.span}")
         
         total_events = 0
-        chunks_scanned = 0
+        windows_scanned = 0
         
-        while start_block < current_block and chunks_scanned < MAX_CHUNKS:
-            end_block = min(start_block + CHUNK_SIZE - 1, current_block)
+        # Process windows in block order, stopping at the first gap
+        for window_start, window_end, logs in windows:
+            if logs is None:
+                log.info(f"⚠️  Blocks {window_start} → {window_end} failed, will retry next run")
+                break
             
-            print(f"🔍 Chunk {chunks_scanned + 1}: blocks {start_block} → {end_block}...")
+            log.info(f"🔍 Window {windows_scanned + 1}: blocks {window_start} → {window_end} ({len(logs)} transfers)")
             
-            # Try each RPC until one works
-            events = None
-            for rpc in BSC_RPCS:
-                try:
-                    w3_temp = Web3(Web3.HTTPProvider(rpc))
-                    if not w3_temp.is_connected():
-                        continue
-                        
-                    contract_temp = w3_temp.eth.contract(
-                        address=Web3.to_checksum_address(XGT_CONTRACT),
-                        abi=CONTRACT_ABI
-                    )
-                    
-                    events = contract_temp.events.Transfer.get_logs(
-                        from_block=start_block,
-                        to_block=end_block
-                    )
-                    break
-                    
-                except Exception as e:
+            total_events += len(logs)
+            for entry in logs:
+                # Decode Transfer by hand: from/to are the low 20 bytes of topics 1/2
+                # (the value in log data is not used by any pattern)
+                topics = entry['topics']
+                # Skip zero address (mints/burns) with a topic compare, before building strings
+                if topics[1] == ZERO_TOPIC or topics[2] == ZERO_TOPIC:
                     continue
+                self.analyze_transfer(
+                    '0x' + topics[1][-40:],
+                    '0x' + topics[2][-40:],
+                    int(entry['blockNumber'], 16)
+                )
             
-            if events is not None:
-                total_events += len(events)
-                for event in events:
-                    self.analyze_transfer(event)
-                self.last_block = end_block
-            else:
-                print(f"⚠️  Chunk failed, will retry next run")
-                break
-            
-            start_block = end_block + 1
-            chunks_scanned += 1
+            # Score each candidate once per window instead of once per trade
+            for trader in self.pending_checks:
+                self.check_bot_pattern(trader, self.trader_stats[trader])
+            self.pending_checks.clear()
+            self.last_block = window_end
+            windows_scanned += 1
         
-        print(f"\n📊 TOTAL: {total_events} transfers from {chunks_scanned} chunks")
+        log.info(f"\n📊 TOTAL: {total_events} transfers from {windows_scanned} windows")
     
-    def analyze_transfer(self, event):
-        """Analyze a single transfer event"""
-        from_addr = event['args']['from']
-        to_addr = event['args']['to']
-        amount = event['args']['value']
-        block_num = event['blockNumber']
-        
-        # Skip zero address (mints/burns)
-        zero_addr = '0x0000000000000000000000000000000000000000'
-        if from_addr == zero_addr or to_addr == zero_addr:
-            return
-        
+    def analyze_transfer(self, from_addr, to_addr, block_num):
+        """Analyze a single transfer (addresses as lowercase hex, mints/burns already skipped)"""
         # Track BOTH sender and receiver for comprehensive monitoring
         for trader in [from_addr, to_addr]:
-            if trader not in self.trader_stats:
-                self.trader_stats[trader] = {
-                    'buys': [], 'sells': [], 'trades': [], 'first_seen': block_num
-                }
+            # Already flagged - nothing more to learn from its trades.
+            # The LP pair is the other side of every trade in pair mode, not a trader.
+            if trader in self.detected_bots or trader == LP_ADDRESS:
+                continue
             
-            stats = self.trader_stats[trader]
+            # One lookup on the common (already tracked) path
+            stats = self.trader_stats.get(trader)
+            if stats is None:
+                stats = self.trader_stats[trader] = new_stats(block_num)
             
             # Determine if this is a buy or sell (relative to the trader)
-            is_sender = (trader == from_addr)
-            trade = {
-                'type': 'send' if is_sender else 'receive',
-                'block': block_num,
-                'amount': str(amount),
-                'counterparty': to_addr if is_sender else from_addr
-            }
-            
-            stats['trades'].append(trade)
-            if is_sender:
-                stats['sells'].append(trade)
-            else:
-                stats['buys'].append(trade)
+            stats['blocks'].append(block_num)
+            stats['sides'].append(SELL if trader == from_addr else BUY)
+            stats['total_trades'] += 1
+            prune_stats(stats, block_num - PRUNE_BLOCKS)
             
-            if len(stats['trades']) >= MIN_TRADES_TO_FLAG:
-                self.check_bot_pattern(trader, stats)
+            if len(stats['blocks']) >= MIN_TRADES_TO_FLAG:
+                self.pending_checks.add(trader)
     
     def check_bot_pattern(self, address, stats):
         """Detect bot trading patterns"""
         if address in self.detected_bots:
             return
         
+        # Only re-score after CHECK_DELTA new trades since the last check
+        total_trades = stats['total_trades']
+        if total_trades - stats['_last_checked_len'] < CHECK_DELTA:
+            return
+        stats['_last_checked_len'] = total_trades
+        
+        # Zero-copy NumPy views over the array columns
+        buy_count, sell_count, avg_hold, trades_per_hour, same_block = detect_patterns(
+            column_view(stats['blocks']),
+            column_view(stats['sides']),
+            stats['first_seen'],
+            total_trades
+        )
+        
         reasons = []
         
         # Pattern 1: Wash trading
-        buy_count = len(stats['buys'])
-        sell_count = len(stats['sells'])
         if buy_count > 0 and sell_count > 0:
             wash_ratio = min(buy_count, sell_count) / max(buy_count, sell_count)
             if wash_ratio >= WASH_TRADING_THRESHOLD:
                 reasons.append(f"WASH_TRADING ({buy_count}B/{sell_count}S, ratio:{wash_ratio:.2f})")
         
         # Pattern 2: Short hold times
-        total_hold_blocks = 0
-        pairs = 0
-        for sell in stats['sells']:
-            prev_buys = [b for b in stats['buys'] if b['block'] < sell['block']]
-            if prev_buys:
-                latest_buy = max(prev_buys, key=lambda x: x['block'])
-                hold_time = sell['block'] - latest_buy['block']
-                total_hold_blocks += hold_time
-                pairs += 1
-        
-        if pairs > 0:
-            avg_hold = total_hold_blocks / pairs
-            if avg_hold < MAX_AVG_HOLD_BLOCKS:
-                reasons.append(f"RAPID_TRADING (avg_hold:{int(avg_hold)}blk={int(avg_hold*3/60)}min)")
+        if 0 <= avg_hold < MAX_AVG_HOLD_BLOCKS:
+            reasons.append(f"RAPID_TRADING (avg_hold:{int(avg_hold)}blk={int(avg_hold*3/60)}min)")
         
         # Pattern 3: High frequency
-        block_range = stats['trades'][-1]['block'] - stats['first_seen']
-        if block_range > 0:
-            trades_per_hour = (len(stats['trades']) / block_range) * 1200
-            if trades_per_hour > MAX_TRADES_PER_HOUR:
-                reasons.append(f"HIGH_FREQUENCY ({trades_per_hour:.1f}trades/hr)")
+        if trades_per_hour > MAX_TRADES_PER_HOUR:
+            reasons.append(f"HIGH_FREQUENCY ({trades_per_hour:.1f}trades/hr)")
         
         # Pattern 4: Same-block trading
-        for i in range(len(stats['trades']) - 1):
-            if (stats['trades'][i]['block'] == stats['trades'][i+1]['block'] and
-                stats['trades'][i]['type'] != stats['trades'][i+1]['type']):
-                reasons.append("SAME_BLOCK_BUY_SELL")
-                break
+        if same_block:
+            reasons.append("SAME_BLOCK_BUY_SELL")
         
         if len(reasons) >= 2:
             self.log_bot_detection(address, reasons, stats)
     
     def log_bot_detection(self, address, reasons, stats):
         """Log detected bot to file"""
-        print(f"\n{'='*70}")
-        print(f"🚨 BOT DETECTED: {address}")
-        print(f"{'='*70}")
+        trade_count = len(stats['sides'])
+        buy_count = stats['sides'].count(BUY)
+        sell_count = trade_count - buy_count
+        
+        log.debug(f"\n{'='*70}")
+        checksum_addr = Web3.to_checksum_address(address)
+        log.info(f"🚨 BOT DETECTED: {checksum_addr}")
+        log.debug(f"{'='*70}")
         for r in reasons:
-            print(f"   ⚠️  {r}")
-        print(f"   📊 Total Trades: {len(stats['trades'])} ({len(stats['buys'])} buys, {len(stats['sells'])} sells)")
-        print(f"   🕐 First Seen: Block {stats['first_seen']}")
-        print(f"{'='*70}\n")
+            log.info(f"   ⚠️  {r}")
+        log.info(f"   📊 Total Trades: {trade_count} ({buy_count} buys, {sell_count} sells)")
+        log.info(f"   🕐 First Seen: Block {stats['first_seen']}")
+        log.debug(f"{'='*70}\n")
         
         self.detected_bots.add(address)
         
-        # Log to file
-        with open('blacklisted.log', 'a') as f:
-            timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
-            reason_str = " | ".join(reasons)
-            f.write(f"[{timestamp}] 🚨 BOT: {address}\n")
-            f.write(f"           PATTERNS: {reason_str}\n")
-            f.write(f"           STATS: {len(stats['trades'])} trades ({len(stats['buys'])}B/{len(stats['sells'])}S)\n")
-            f.write(f"           ACTION: LOGGED (Manual review recommended)\n")
-            f.write(f"{'-'*70}\n")
+        # Log to file - one buffered write per detection, flushed by run()
+        timestamp = '%04d-%02d-%02d %02d:%02d:%02d UTC' % time.gmtime()[:6]
+        reason_str = " | ".join(reasons)
+        self.detection_log.write(
+            f"[{timestamp}] 🚨 BOT: {checksum_addr}\n"
+            f"           PATTERNS: {reason_str}\n"
+            f"           STATS: {trade_count} trades ({buy_count}B/{sell_count}S)\n"
+            f"           ACTION: LOGGED (Manual review recommended)\n"
+            f"{'-'*70}\n"
+        )
     
     def run(self):
         """Main execution"""
-        start_time = datetime.utcnow()
-        print(f"🕐 RUN START: {start_time.isoformat()} UTC\n")
-        
-        self.scan_recent_blocks()
-        self.save_state()
-        
-        end_time = datetime.utcnow()
-        duration = (end_time - start_time).total_seconds()
-        
-        print(f"\n{'='*70}")
-        print(f"📊 SCAN SUMMARY")
-        print(f"{'='*70}")
-        print(f"   Addresses Tracked: {len(self.trader_stats)}")
-        print(f"   Bots Detected: {len(self.detected_bots)}")
-        print(f"   Last Block Scanned: {self.last_block}")
-        print(f"   Scan Duration: {duration:.2f} seconds")
-        print(f"   Next Scan: ~5 minutes")
-        print(f"{'='*70}")
-        print(f"\n✅ HYPERION GUARD - SCAN COMPLETE\n")
+        try:
+            start_time = datetime.now(timezone.utc)
+            log.info(f"🕐 RUN START: {start_time.isoformat()}\n")
+            
+            self.scan_recent_blocks()
+            # Detections reach the disk before the state that marks them detected
+            self.detection_log.flush()
+            os.fsync(self.detection_log.fileno())
+            if self._dirty:
+                self.save_state()
+            else:
+                log.info(f"💾 Already up to date, state not rewritten")
+            
+            end_time = datetime.now(timezone.utc)
+            duration = (end_time - start_time).total_seconds()
+            
+            log.info(f"\n{'='*70}")
+            log.info(f"📊 SCAN SUMMARY")
+            log.info(f"{'='*70}")
+            log.info(f"   Addresses Tracked: {len(self.trader_stats)}")
+            log.info(f"   Bots Detected: {len(self.detected_bots)}")
+            log.info(f"   Last Block Scanned: {self.last_block}")
+            log.info(f"   Scan Duration: {duration:.2f} seconds")
+            log.info(f"   Next Scan: ~5 minutes")
+            log.info(f"{'='*70}")
+            log.info(f"\n✅ HYPERION GUARD - SCAN COMPLETE\n")
+        finally:
+            # Log handler defers flushing to here
+            sys.stdout.flush()
+            self.detection_log.close()
 
 if __name__ == '__main__':
+    # HYPERION_VERBOSE=1 also shows the decorative detection banners
+    logging.basicConfig(
+        level=logging.DEBUG if os.environ.get('HYPERION_VERBOSE') else logging.INFO,
+        format='%(message)s',
+        handlers=[BufferedLogHandler(sys.stdout)]
+    )
     try:
         guard = HyperionGuard()
         guard.run()
     except Exception as e:
-        print(f"\n❌ FATAL ERROR: {e}\n")
+        log.error(f"\n❌ FATAL ERROR: {e}\n")
+        sys.stdout.flush()
         import traceback
         traceback.print_exc()
         raise